@@ -7,9 +7,25 @@ from datetime import *
 import re
 import csv
 import toml
+import gzip
+import zlib
+import bz2
+import lzma
+import io
+import zipfile
+import locale
+import struct
+from array import array
 
 import json
 import sys
+import os
+import hashlib
+import sqlite3
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter, localtime
+from multiprocessing import shared_memory
 #import datetime
 #import glob
 
@@ -29,6 +45,7 @@ import sys
 - Kyle needs to have 2 grades of "fast". One underline, one bold underline. Formalise [FAST] and [VFAST].
 
 === FIXED ===
+- webvtt export permenantly rewrote event times, so any output written after it got webvtt times.
 - Any place "event.voice_over = event.voice_over" is problematic. Fix.
 - webvtt export permenantly transforms > into &gt; - needs to only operate on a copy for that.
 - RTF output seems to be without capital letters for first sentence!
@@ -37,10 +54,14 @@ import sys
 == Function List ==
 
 === Input ===
-parse_srt(lines:list[str]) -> list[AdEvent]
+parse_srt(lines:list[str], observer:AdObserver = None) -> list[AdEvent]
 
 === Helper ===
+open_file(filename:str, mode:str = "r")
 get_duration(a:str, b:str) -> str
+time_to_ms(time:str) -> int
+ms_to_time(ms:int) -> str
+get_webvtt_time(time:str) -> str
 find_fast(voiceover) -> bool
 
 === Output ===
@@ -48,7 +69,41 @@ write_srt(output_filename:str, ad_script:list[AdEvent], start_from:int = 1)
 write_csv(output_filename:str, ad_script:list[AdEvent], collapse_lines:bool = False, start_from:int = 1)
 write_kyle(output_filename:str, ad_script:list[AdEvent], numbered:bool = False)
 write_rtf(output_filename:str, ad_script:list[AdEvent], metadata:dict)
-write_webvtt(output_filename:str, ad_script:list[AdEvent], metadata:dict, start_from:int = 1, collapse_lines:bool = False)
+write_webvtt(output_filename:str, ad_script:list[AdEvent], metadata:dict, start_from:int = 1, collapse_lines:bool = False, word_timing:bool = False)
+estimate_word_times(ad_script:list[AdEvent]) -> list[list[int]]
+write_format(fmt:str, filename:str, ad_script:list[AdEvent], metadata:AdMetaData, ext:str = "", observer:AdObserver = None, bundle:AdBundle = None) -> str
+
+All of the parse and write functions take an optional observer:AdObserver, for
+progress, warnings, cancellation and per-cue timing. Problems raise AdError.
+
+=== Series ===
+load_manifest(input_filename:str) -> AdSeries
+build_series(series:AdSeries, jobs:int = None, force:bool = False) -> list[str]
+
+=== Editing ===
+AdScript(ad_script:list[AdEvent]) - insert, delete, split, merge, retime, undo, export
+create_event(time_in:str, time_out:str, voice_over:str) -> AdEvent
+
+=== Random access ===
+load_index(srt_filename:str, rebuild:bool = False) -> AdIndex
+AdIndex.get_cues(first:int, last:int) -> list[AdEvent]
+AdIndex.get_cues_between(start:str, end:str) -> list[AdEvent]
+AdIndex.close()
+
+=== Shared memory ===
+AdSharedScript.create(ad_script:list[AdEvent]) -> AdSharedScript
+map_cues(function, shared:AdSharedScript, jobs:int = None, chunks:int = None) -> list
+
+=== Near duplicates ===
+find_duplicates(cues:list[tuple[str, AdEvent]], threshold:float = 0.8) -> list[list[tuple[str, AdEvent]]]
+
+=== Dialogue ===
+find_gaps(ad_script:list[AdEvent], dialogue:list[AdEvent]) -> list[AdGap]
+
+=== Corpus ===
+open_corpus(database:str) -> sqlite3.Connection
+ingest_scripts(connection:sqlite3.Connection, scripts:list[tuple[str, AdMetaData]]) -> int
+search_cues(connection:sqlite3.Connection, text:str = None, direction:str = None, min_duration:float = None, script:str = None, raw:bool = False) -> list[tuple[str, AdEvent]]
 
 """
 
@@ -66,6 +121,72 @@ class AdEvent:
 	direction: list = field(default_factory=list) 
 	voice_over: str = ""
 
+class AdError(Exception):
+
+	""" Something went wrong in adlib. event is the cue it went wrong at, if any. """
+
+	def __init__(self, message:str, event:AdEvent = None):
+		super().__init__(message)
+		self.event = event
+
+
+class AdCancelled(AdError):
+
+	""" The observer asked for the job to be cancelled """
+
+
+class AdObserver:
+
+	"""
+	Watch parse_srt and the writers. Override whichever of these you need.
+
+	stage is "parse", or the name of the output being written (eg: "vtt").
+	The default observer does nothing, and passing no observer at all costs
+	next to nothing.
+	"""
+
+	def stage_start(self, stage:str, total:int):
+		""" A stage is starting. total is the number of cues it will get through. """
+		pass
+
+	def stage_end(self, stage:str):
+		pass
+
+	def cue_parsed(self, event:AdEvent):
+		pass
+
+	def cue_rendered(self, stage:str, event:AdEvent):
+		pass
+
+	def warning(self, message:str, event:AdEvent = None):
+		""" Something's not right, but we carried on """
+		pass
+
+	def cancelled(self) -> bool:
+		""" Checked before every cue. Return True to stop with AdCancelled. """
+		return False
+
+
+class AdTimer(AdObserver):
+
+	""" Observer that records how long each cue took: (stage, cue number, seconds) """
+
+	def __init__(self):
+		self.timings:list[tuple[str, int, float]] = []
+		self.last:float = 0
+
+	def stage_start(self, stage:str, total:int):
+		self.last = perf_counter()
+
+	def cue_parsed(self, event:AdEvent):
+		self.cue_rendered("parse", event)
+
+	def cue_rendered(self, stage:str, event:AdEvent):
+		now = perf_counter()
+		self.timings.append((stage, event.number, now - self.last))
+		self.last = now
+
+
 @dataclass
 class AdMetaData:
 
@@ -86,22 +207,34 @@ class AdMetaData:
 
 		# We're now using TOML. Much nicer.
 		try:
-			with open(input_filename, "rb") as read_file:
-				data = tomli.load(read_file)
-		except:
-			print("Unable to open file " + input_filename)
-			exit()
-
-		self.title = data["title"]
-		self.author = data["author"]
-		self.date = data["date"].strftime("%Y-%m-%d")
-		self.licence = data["licence"]
-		self.rights = data["rights"]
-		self.url = data["url"]
-		self.subject = data["subject"]
-		self.keywords = data["keywords"]
-		self.company = self.author
-		self.filename = data["filename"] 
+			with open(input_filename, "r") as read_file:
+				data = toml.load(read_file)
+		except (OSError, ValueError) as error:
+			raise AdError("Unable to open file " + input_filename) from error
+
+		self.set_metadata(data)
+
+
+	def set_metadata(self, data:dict):
+
+		""" Fill in the metadata from a dictionary (eg: a TOML table) """
+
+		try:
+			self.title = data["title"]
+			self.author = data["author"]
+			self.date = data["date"]
+			self.licence = data["licence"]
+			self.rights = data["rights"]
+			self.url = data["url"]
+			self.subject = data["subject"]
+			self.keywords = data["keywords"]
+			self.company = self.author
+			self.filename = data["filename"] 
+		except KeyError as error:
+			raise AdError("Metadata is missing " + str(error)) from error
+
+		if not isinstance(self.date, str):
+			self.date = self.date.strftime("%Y-%m-%d")
 
 
 	def get_markdown_metadata(self) -> str:
@@ -186,7 +319,7 @@ class AdMetaData:
 		x:list[str]  = self.date.split("-")
 
 		if len(x) != 3:
-			raise ValueError('Metadata date format incorrect. Must be yyyy-mm-dd.')
+			raise AdError("Metadata date format incorrect. Must be yyyy-mm-dd: " + self.date)
 		
 		return "{\\creatim\\yr" + x[0] + "\\mo" + x[1] + "\\dy" + x[2] + "}\n"
 
@@ -204,7 +337,7 @@ def parse_csv(lines:list[str]) -> list[AdEvent]:
 
 
 
-def parse_srt(lines:list[str]) -> list[AdEvent]:
+def parse_srt(lines:list[str], observer:AdObserver = None) -> list[AdEvent]:
 
 	"""
 	Convert an SRT file into internal format, defined as a dataclass
@@ -224,6 +357,9 @@ def parse_srt(lines:list[str]) -> list[AdEvent]:
 
 	current_cue = AdEvent()
 
+	if observer is not None:
+		observer.stage_start("parse", sum(1 for line in lines if "-->" in line))
+
 	for line in lines:
 		line = line.strip()
 
@@ -231,7 +367,15 @@ def parse_srt(lines:list[str]) -> list[AdEvent]:
 			cue += 1
 			start_time = line[0:12]
 			end_time = line[17:]
-			duration = get_duration(start_time,end_time)
+
+			if observer is not None and observer.cancelled():
+				raise AdCancelled("Cancelled at cue " + str(cue))
+
+			try:
+				duration = get_duration(start_time,end_time)
+			except ValueError as error:
+				raise AdError("Unable to read the times of cue " + str(cue) + ": " + line) from error
+
 			current_state = GET_TEXT
 			text_line = 0
 
@@ -240,6 +384,9 @@ def parse_srt(lines:list[str]) -> list[AdEvent]:
 			current_cue.time_out = end_time
 			current_cue.duration = duration
 
+			if observer is not None and time_to_ms(end_time) < time_to_ms(start_time):
+				observer.warning("Cue " + str(cue) + " ends before it starts", current_cue)
+
 			continue
 
 		if line == "":
@@ -252,6 +399,9 @@ def parse_srt(lines:list[str]) -> list[AdEvent]:
 
 			cues.append(current_cue)
 
+			if observer is not None:
+				observer.cue_parsed(current_cue)
+
 			# Reset everything
 			current_cue = AdEvent() 
 			text = ""
@@ -269,6 +419,12 @@ def parse_srt(lines:list[str]) -> list[AdEvent]:
 		current_cue.voice_over = text
 		cues.append(current_cue)
 
+		if observer is not None:
+			observer.cue_parsed(current_cue)
+
+	if observer is not None:
+		observer.stage_end("parse")
+
 	return cues
 
 
@@ -279,6 +435,36 @@ def parse_srt(lines:list[str]) -> list[AdEvent]:
 
 # =======================================
 
+# Compression codecs, chosen by file extension
+COMPRESSORS = {
+	".gz": gzip,
+	".bz2": bz2,
+	".xz": lzma,
+}
+
+# What reading a file can raise: OSError, or a truncated or damaged compressed file
+READ_ERRORS = (OSError, EOFError, zlib.error, lzma.LZMAError)
+
+
+def open_file(filename:str, mode:str = "r"):
+
+	"""
+	Open a text file for reading or writing.
+	Files ending in .gz, .bz2 or .xz are (de)compressed on the fly,
+	so there's never an uncompressed copy on disk.
+	Anything that isn't a filename is assumed to be open already (eg: a bundle entry).
+	"""
+
+	if not isinstance(filename, str):
+		return filename
+
+	for extension, codec in COMPRESSORS.items():
+		if filename.endswith(extension):
+			return codec.open(filename, mode + "t")
+
+	return open(filename, mode)
+
+
 def get_duration(a:str, b:str) -> str:
 
 	"""
@@ -305,6 +491,27 @@ def get_duration(a:str, b:str) -> str:
 	return(str(duration))
 
 
+def time_to_ms(time:str) -> int:
+
+	""" Convert an SRT time (00:01:02,345) into milliseconds """
+
+	return (int(time[0:2]) * 3600000
+		+ int(time[3:5]) * 60000
+		+ int(time[6:8]) * 1000
+		+ int(time[9:12]))
+
+
+def ms_to_time(ms:int) -> str:
+
+	""" Convert milliseconds into an SRT time (00:01:02,345) """
+
+	seconds, ms = divmod(ms, 1000)
+	minutes, seconds = divmod(seconds, 60)
+	hours, minutes = divmod(minutes, 60)
+
+	return "%02d:%02d:%02d,%03d" % (hours, minutes, seconds, ms)
+
+
 def add_to_time(time:str, offset:int) -> str:
 
 	"""
@@ -349,7 +556,20 @@ def convert_to_utf(voiceover) -> str:
 
 # =======================================
 
-def write_srt(output_filename:str, ad_script:list[AdEvent], start_from:int = 1):
+def render_srt_cue(event:AdEvent, number:int, last:bool = False) -> str:
+
+	""" Render one cue of an SRT file """
+
+	text = event.voice_over + '\n\n'
+
+	# Remove any trailing newlines from the last event
+	if last:
+		text = text.strip()
+
+	return str(number) + '\n' + event.time_in + " --> " + event.time_out + '\n' + text
+
+
+def write_srt(output_filename:str, ad_script:list[AdEvent], start_from:int = 1, observer:AdObserver = None):
 
 	"""
 	Convert internal format to a .srt file
@@ -358,62 +578,93 @@ def write_srt(output_filename:str, ad_script:list[AdEvent], start_from:int = 1):
 	srt_content:list[str] = []
 	count:int = start_from
 
-	for event in ad_script:
+	if observer is not None:
+		observer.stage_start("srt", len(ad_script))
+
+	for i, event in enumerate(ad_script):
+		if observer is not None and observer.cancelled():
+			raise AdCancelled("Cancelled at cue " + str(event.number), event)
+
 		try:
-			srt_content.append(str(count) + '\n')
+			srt_content.append(render_srt_cue(event, count, i == len(ad_script) - 1))
 			count += 1
-			srt_content.append(event.time_in + " --> " + event.time_out + '\n')
-			srt_content.append(event.voice_over + '\n\n')
-		except:
-			print("Problem at: ")
-			print(event)
-	
-	# Remove any trailing newlines from the last event
-	x:str = srt_content.pop().strip()
-	srt_content.append(x)
+		except Exception as error:
+			raise AdError("Problem at cue " + str(event.number), event) from error
 
-	with open(output_filename, "w") as output_file:
+		if observer is not None:
+			observer.cue_rendered("srt", event)
+
+	if observer is not None:
+		observer.stage_end("srt")
+
+	with open_file(output_filename, "w") as output_file:
 		for line in srt_content:
 			output_file.write(line)
 
 
 
-def write_csv(output_filename:str, ad_script:list[AdEvent], collapse_lines:bool = False, start_from:int = 1):
+# Figure out what line terminator we want to generate
+if sys.platform.startswith('win'):
+	# Microsoft Windows
+	CSV_LINE_TERMINATOR = '\r'
+else:
+	# Everything else, until it breaks
+	CSV_LINE_TERMINATOR = '\r\n'
 
-	""" Render the internal data structure into tab delimited CSV data """
 
-	nl = ''
+def render_csv_cue(event:AdEvent, number:int, collapse_lines:bool = False) -> str:
 
-	# Figure out what line terminator we want to generate
-	if sys.platform.startswith('win'):
-		# Microsoft Windows
-		nl = '\r'
-	else:
-		# Everything else, until it breaks
-		nl = '\r\n'
+	""" Render one cue as a row of CSV """
 
-	with open(output_filename, mode='w') as ad_file:
-		ad_writer = csv.writer(ad_file, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL, lineterminator=nl)
-		count:int = start_from
+	voiceover = event.voice_over 
+	if collapse_lines:
+		voiceover = voiceover.replace('\n',' ')
 
-		for event in ad_script:
+	row = io.StringIO()
+	ad_writer = csv.writer(row, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL, lineterminator=CSV_LINE_TERMINATOR)
+	ad_writer.writerow([
+		number, 
+		event.time_in,
+		event.time_out,
+		event.duration[:-3], # Truncate least significant 3 digits.
+		voiceover
+	])
 
-			voiceover = event.voice_over 
-			if collapse_lines:
-				voiceover = voiceover.replace('\n',' ')
+	return row.getvalue()
 
-			ad_writer.writerow([
-				count, 
-				event.time_in,
-				event.time_out,
-				event.duration[:-3], # Truncate least significant 3 digits.
-				voiceover
-			])
 
+def write_csv(output_filename:str, ad_script:list[AdEvent], collapse_lines:bool = False, start_from:int = 1, observer:AdObserver = None):
+
+	""" Render the internal data structure into tab delimited CSV data """
+
+	csv_content:list[str] = []
+	count:int = start_from
+
+	if observer is not None:
+		observer.stage_start("csv", len(ad_script))
+
+	for event in ad_script:
+		if observer is not None and observer.cancelled():
+			raise AdCancelled("Cancelled at cue " + str(event.number), event)
+
+		try:
+			csv_content.append(render_csv_cue(event, count, collapse_lines))
 			count += 1
+		except Exception as error:
+			raise AdError("Problem at cue " + str(event.number), event) from error
+
+		if observer is not None:
+			observer.cue_rendered("csv", event)
+
+	if observer is not None:
+		observer.stage_end("csv")
+
+	with open_file(output_filename, mode='w') as ad_file:
+		for line in csv_content:
+			ad_file.write(line)
 
 
-def write_kyle(output_filename:str, ad_script:list[AdEvent], metadata:AdMetaData = None, numbered:bool = False, collapse_lines:bool = False):
+def write_kyle(output_filename:str, ad_script:list[AdEvent], metadata:AdMetaData = None, numbered:bool = False, collapse_lines:bool = False, observer:AdObserver = None):
 
 	# Create the RTF content
 
@@ -457,76 +708,91 @@ def write_kyle(output_filename:str, ad_script:list[AdEvent], metadata:AdMetaData
 
 	font_size = "\\fs36"
 
+	if observer is not None:
+		observer.stage_start("kyle", len(ad_script))
+
 	for event in ad_script:
+		if observer is not None and observer.cancelled():
+			raise AdCancelled("Cancelled at cue " + str(event.number), event)
 
-		voiceover = event.voice_over
+		try:
+			voiceover = event.voice_over
 
-		# In theory, this creates an invisible "comment"
-		# However, it doesn't survive being opened in another program and saved.
-		# rtf_content.append("\n{\\*\\time_in\n" + event.time_in + "\n}")
+			# In theory, this creates an invisible "comment"
+			# However, it doesn't survive being opened in another program and saved.
+			# rtf_content.append("\n{\\*\\time_in\n" + event.time_in + "\n}")
 
-		start = "\n\\par\\par\n" + font_size + " "
-		end = ""
+			start = "\n\\par\\par\n" + font_size + " "
+			end = ""
 
-		# For events marked [FAST], bold and underline them
-		if event.direction != None:
+			# For events marked [FAST], bold and underline them
+			if event.direction != None:
 
-			if find_fast(event.direction):
-				# Fast-ish: underline, Fast: bold+underline
-				if "ish" in event.direction[0] or "ISH" in event.direction[0]:
-					start += "{\\ul "
-				else:
-					start += "{\\b\\ul "
+				if find_fast(event.direction):
+					# Fast-ish: underline, Fast: bold+underline
+					if "ish" in event.direction[0] or "ISH" in event.direction[0]:
+						start += "{\\ul "
+					else:
+						start += "{\\b\\ul "
 
-				end = "}"
-				x = re.match(r"(\[[^]]*\])",voiceover)
-				if x != None:
-					# Note, mypy has no way of knowing that x is not None
-					# but with the above conditional, we guarantee it.
-					# so typechecking of x ignored here.
-					voiceover = voiceover[x.span()[1]:].strip() # type:ignore
+					end = "}"
+					x = re.match(r"(\[[^]]*\])",voiceover)
+					if x != None:
+						# Note, mypy has no way of knowing that x is not None
+						# but with the above conditional, we guarantee it.
+						# so typechecking of x ignored here.
+						voiceover = voiceover[x.span()[1]:].strip() # type:ignore
 
 
-		# Fix some character conventions. A bit on the brute-force side. :-/
+			# Fix some character conventions. A bit on the brute-force side. :-/
 
-		voiceover = voiceover.replace("{","\\'7b") # Convert Curly Braces
-		voiceover = voiceover.replace("}","\\'7d") # Convert Curly Braces 
+			voiceover = voiceover.replace("{","\\'7b") # Convert Curly Braces
+			voiceover = voiceover.replace("}","\\'7d") # Convert Curly Braces 
 
-		voiceover = voiceover.replace("“","\\'93") # Convert Unicode double quotes
-		voiceover = voiceover.replace("”","\\'94") # Convert Unicode double quotes
+			voiceover = voiceover.replace("“","\\'93") # Convert Unicode double quotes
+			voiceover = voiceover.replace("”","\\'94") # Convert Unicode double quotes
 
-		voiceover = voiceover.replace("‘","\\'91") # Convert Unicode single quotes - left
-		voiceover = voiceover.replace("’","\\'92") # Convert Unicode single quotes - right
+			voiceover = voiceover.replace("‘","\\'91") # Convert Unicode single quotes - left
+			voiceover = voiceover.replace("’","\\'92") # Convert Unicode single quotes - right
 
-		voiceover = voiceover.replace("--","\\'97") # Replace psuedo Em dash
-		voiceover = voiceover.replace("—","\\'97") # Replace unicode Em dash
+			voiceover = voiceover.replace("--","\\'97") # Replace psuedo Em dash
+			voiceover = voiceover.replace("—","\\'97") # Replace unicode Em dash
 
-		voiceover = voiceover.replace("...","\\'85") # Replace psuedo ellipsis with real thing
-		voiceover = voiceover.replace("…","\\'85") # Replace unicode ellipsis with real thing
+			voiceover = voiceover.replace("...","\\'85") # Replace psuedo ellipsis with real thing
+			voiceover = voiceover.replace("…","\\'85") # Replace unicode ellipsis with real thing
 
-		# Collapse lines = honour carriage returns as line breaks.
-		if collapse_lines:
-			voiceover = voiceover.replace('\n',' ')
-		else:
-			voiceover = voiceover.replace('\n','\\par\n')
+			# Collapse lines = honour carriage returns as line breaks.
+			if collapse_lines:
+				voiceover = voiceover.replace('\n',' ')
+			else:
+				voiceover = voiceover.replace('\n','\\par\n')
 
-		if numbered:
-			rtf_content.append(start + str(count) + ".  " + voiceover + end)
-		else:
-			rtf_content.append(start + voiceover + end)
+			if numbered:
+				rtf_content.append(start + str(count) + ".  " + voiceover + end)
+			else:
+				rtf_content.append(start + voiceover + end)
+
+			count += 1
 
-		count += 1
+		except Exception as error:
+			raise AdError("Problem at cue " + str(event.number), event) from error
+
+		if observer is not None:
+			observer.cue_rendered("kyle", event)
+
+	if observer is not None:
+		observer.stage_end("kyle")
 
 	# ... Close the RTF document
 	rtf_content.append("\n}")
 
 	# Save the RTF document
-	with open(output_filename, "w") as rtf_file:
+	with open_file(output_filename, "w") as rtf_file:
 		for i in rtf_content:
 			rtf_file.write(i)
 
 
-def write_rtf(output_filename:str, ad_script:list[AdEvent], metadata:AdMetaData = None, collapse_lines:bool = False):
+def write_rtf(output_filename:str, ad_script:list[AdEvent], metadata:AdMetaData = None, collapse_lines:bool = False, observer:AdObserver = None):
 
 	"""
 
@@ -578,113 +844,288 @@ def write_rtf(output_filename:str, ad_script:list[AdEvent], metadata:AdMetaData
 	count = 1
 	lines = 0
 
+	if observer is not None:
+		observer.stage_start("rtf", len(ad_script))
+
 	for event in ad_script:
+		if observer is not None and observer.cancelled():
+			raise AdCancelled("Cancelled at cue " + str(event.number), event)
 
-		rtf_content.append("\n\\par\\par\n")
+		try:
+			rtf_content.append("\n\\par\\par\n")
 
-		voiceover = event.voice_over
+			voiceover = event.voice_over
 
 
-		# Fix some character conventions. A bit on the brute-force side. :-/
+			# Fix some character conventions. A bit on the brute-force side. :-/
 
-		voiceover = voiceover.replace("“","\\'93") # Convert Unicode double quotes
-		voiceover = voiceover.replace("”","\\'94") # Convert Unicode double quotes
+			voiceover = voiceover.replace("“","\\'93") # Convert Unicode double quotes
+			voiceover = voiceover.replace("”","\\'94") # Convert Unicode double quotes
 
-		voiceover = voiceover.replace("‘","\\'91") # Convert Unicode single quotes - left
-		voiceover = voiceover.replace("’","\\'92") # Convert Unicode single quotes - right
+			voiceover = voiceover.replace("‘","\\'91") # Convert Unicode single quotes - left
+			voiceover = voiceover.replace("’","\\'92") # Convert Unicode single quotes - right
 
-		voiceover = voiceover.replace("--","\\'97") # Replace psuedo Em dash
-		voiceover = voiceover.replace("—","\\'97") # Replace unicode Em dash
+			voiceover = voiceover.replace("--","\\'97") # Replace psuedo Em dash
+			voiceover = voiceover.replace("—","\\'97") # Replace unicode Em dash
 
-		voiceover = voiceover.replace("...","\\'85") # Replace psuedo ellipsis with real thing
-		voiceover = voiceover.replace("…","\\'85") # Replace unicode ellipsis with real thing
+			voiceover = voiceover.replace("...","\\'85") # Replace psuedo ellipsis with real thing
+			voiceover = voiceover.replace("…","\\'85") # Replace unicode ellipsis with real thing
 
-		duration = event.duration[3:-4]
-		if duration[0] == '0':
-			duration = duration[1:]
+			duration = event.duration[3:-4]
+			if duration[0] == '0':
+				duration = duration[1:]
 
-		# Collapse lines = honour carriage returns as line breaks.
-		if collapse_lines:
-			voiceover = voiceover.replace('\n',' ')
-		else:
-			voiceover = voiceover.replace('\n','\\par\n')
+			# Collapse lines = honour carriage returns as line breaks.
+			if collapse_lines:
+				voiceover = voiceover.replace('\n',' ')
+			else:
+				voiceover = voiceover.replace('\n','\\par\n')
+
+			#fs20 = font size: 20/2 = 10pt
+			#li600 = indent 600twips
 
-		#fs20 = font size: 20/2 = 10pt
-		#li600 = indent 600twips
+			# Cue Number, Duration, Start --> End
+			rtf_content.append("{\\fs20\\b{" + str(count) + '\t' + duration + " seconds \\cf1 \t\t" + event.time_in + " --> " + event.time_out + "}}\n\\par\\par\n")
 
-		# Cue Number, Duration, Start --> End
-		rtf_content.append("{\\fs20\\b{" + str(count) + '\t' + duration + " seconds \\cf1 \t\t" + event.time_in + " --> " + event.time_out + "}}\n\\par\\par\n")
+			# Voice-over. (If you want to change font add \\f1 after the li700)
+			rtf_content.append('{\\li700 ' + voiceover + '\\par\n\n}')
 
-		# Voice-over. (If you want to change font add \\f1 after the li700)
-		rtf_content.append('{\\li700 ' + voiceover + '\\par\n\n}')
+			count += 1
+
+		except Exception as error:
+			raise AdError("Problem at cue " + str(event.number), event) from error
 
-		count += 1
+		if observer is not None:
+			observer.cue_rendered("rtf", event)
+
+	if observer is not None:
+		observer.stage_end("rtf")
 
 	# ... Close the RTF document
 	rtf_content.append("\n}")
 
 	# Save the RTF document
-	with open(output_filename, "w") as rtf_file:
+	with open_file(output_filename, "w") as rtf_file:
 		for i in rtf_content:
 			rtf_file.write(i)
 
 
-def write_webvtt(output_filename:str, ad_script:list[AdEvent], metadata:AdMetaData, start_from:int = 1, collapse_lines:bool = False):
+def render_webvtt_header(metadata:AdMetaData = None) -> str:
+
+	""" Render the start of a webvtt file, up to the first cue """
+
+	header = "WEBVTT\n\n"
+
+	# ... Info Block (Metadata)
+
+	if metadata is not None:
+		header += metadata.get_webvtt_info_block() + '\n\n'
+
+	return header
+
+
+def get_webvtt_time(time:str) -> str:
+
+	""" Convert an SRT time (00:01:02,345) to webvtt: 01:02.345, keeping the hours only if there are any """
+
+	time = time[0:8] + '.' + time[9:]
+
+	if time.startswith("00:"):
+		time = time[3:]
+
+	return time
+
+
+def render_webvtt_cue(event:AdEvent, last:bool = False, word_times:list[int] = None) -> str:
+
+	"""
+	Render one cue of a webvtt file.
+	word_times, from estimate_word_times, adds a <00:01.234> timestamp before each word.
+	"""
+
+	# Work on copies, so other outputs still get the SRT times.
+	time_in = get_webvtt_time(event.time_in)
+	time_out = get_webvtt_time(event.time_out)
+
+	voiceover = event.voice_over 
+
+	if word_times is not None:
+		voiceover = add_word_timestamps(voiceover, word_times)
+	else:
+		voiceover = voiceover.replace('>','&gt;') # Escape any '>' characters
+
+	text = voiceover + '\n\n'
+
+	# Remove any trailing newlines from the last event
+	if last:
+		text = text.strip()
+
+	return time_in + " --> " + time_out + '\n' + text
+
+
+# Word timing: syllables spoken per second, how much faster [FAST] cues are read,
+# and how many syllables' worth of pause follows a word ending in punctuation
+SPEECH_RATE = 4.0
+FAST_RATE = 1.3
+FAST_ISH_RATE = 1.15
+CHARACTER_WEIGHT = 0.1
+PAUSES = {",": 0.5, ";": 0.75, ":": 0.75, ".": 1.0, "!": 1.0, "?": 1.0, "—": 1.0, "…": 1.0, "-": 1.0}
+
+WORD_PATTERN = re.compile(r"(\[[^]]*\]|\S+)")
+VOWELS = str.maketrans({c: ("a" if c in "aeiouyAEIOUY" else " ") for c in map(chr, range(128))})
+
+
+def count_syllables(word:str) -> int:
+
+	""" Rough syllable count: runs of vowels, less a silent e """
+
+	count = len(word.translate(VOWELS).split())
+
+	if count > 1 and word[-1:] in "eE":
+		count -= 1
+
+	return max(1, count)
+
+
+def get_word_weight(word:str) -> float:
+
+	""" How long a word takes to say (plus the pause after it), in syllables. Directions take no time. """
+
+	if word[0] == "[":
+		return 0
+
+	if not any(c.isalnum() for c in word):
+		# Stray punctuation, eg: "..."
+		return PAUSES.get(word[-1], 0)
+
+	return count_syllables(word) + CHARACTER_WEIGHT * len(word) + PAUSES.get(word[-1], 0)
+
+
+def estimate_word_times(ad_script:list[AdEvent]) -> list[list[int]]:
+
+	"""
+	Estimate when each word of each cue is spoken: a list per cue with the
+	time (ms) of each word, in the order WORD_PATTERN finds them, or None
+	for directions and stray punctuation, which aren't spoken.
+
+	Words are weighted by syllables and characters, punctuation adds a pause,
+	and the words are read at SPEECH_RATE (faster for [FAST] cues), squeezed
+	if need be to fit the cue.
+	"""
+
+	# Each different word is only weighed once: word -> (weight, spoken?)
+	known:dict = {}
+
+	word_times:list[list[int]] = []
+
+	for event in ad_script:
+		words = WORD_PATTERN.findall(event.voice_over)
+
+		for word in words:
+			if word not in known:
+				known[word] = (get_word_weight(word), word[0] != "[" and any(c.isalnum() for c in word))
+
+		rate = SPEECH_RATE
+		if find_fast(event.direction):
+			rate *= FAST_ISH_RATE if "ish" in event.direction[0].lower() else FAST_RATE
+
+		start = time_to_ms(event.time_in)
+		duration = time_to_ms(event.time_out) - start
+		spoken_weight = sum(known[word][0] for word in words)
+
+		# Read at the normal rate (ms per syllable), unless that doesn't fit
+		scale = 1000 / rate
+		if spoken_weight > 0 and spoken_weight * scale > duration:
+			scale = duration / spoken_weight
+
+		times:list = []
+		offset = 0.0
+
+		for word in words:
+			weight, spoken = known[word]
+			times.append(start + int(offset * scale) if spoken else None)
+			offset += weight
+
+		word_times.append(times)
+
+	return word_times
+
+
+def add_word_timestamps(voiceover:str, word_times:list[int]) -> str:
+
+	""" Escape voiceover for webvtt, and put a <00:01.234> timestamp in front of each word after the first """
+
+	# [gap, word, gap, word, ... gap]
+	parts = WORD_PATTERN.split(voiceover.replace('>','&gt;'))
+
+	# The times only go up, and the first word starts with the cue anyway
+	first = next((time for time in word_times if time is not None), None)
+
+	for i, time in enumerate(word_times):
+		if time is not None and time > first:
+			parts[2 * i + 1] = "<" + get_webvtt_time(ms_to_time(time)) + ">" + parts[2 * i + 1]
+
+	return "".join(parts)
+
+
+def write_webvtt(output_filename:str, ad_script:list[AdEvent], metadata:AdMetaData, start_from:int = 1, collapse_lines:bool = False, observer:AdObserver = None, word_timing:bool = False):
 
 	"""
-	Convert internal format to a webvtt file
+	Convert internal format to a webvtt file.
+	word_timing adds a timestamp to every word, for karaoke-style highlighting.
 	"""
 
+	word_times:list = [None] * len(ad_script)
+	if word_timing:
+		word_times = estimate_word_times(ad_script)
+
 	webvtt_content:list[str] = []
 	count:int = start_from
 
 	# Write header
-	webvtt_content.append("WEBVTT\n\n")
+	webvtt_content.append(render_webvtt_header(metadata))
 
-	# ... Info Block (Metadata)
-
-	if metadata is not None:
-		webvtt_content.append(metadata.get_webvtt_info_block())
-		webvtt_content.append('\n\n')
+	if observer is not None:
+		observer.stage_start("vtt", len(ad_script))
 
 	# Write cues
-	for event in ad_script:
+	for i, event in enumerate(ad_script):
+		if observer is not None and observer.cancelled():
+			raise AdCancelled("Cancelled at cue " + str(event.number), event)
+
 		try:
-			# Adjust Format: 00:00.00
-			# Doubtless there's a more efficent way to do this!
-			event.time_in = event.time_in[3:]
-			event.time_in = event.time_in[0:5] + '.' + event.time_in[6:]
+			webvtt_content.append(render_webvtt_cue(event, i == len(ad_script) - 1, word_times[i]))
+		except Exception as error:
+			raise AdError("Problem at cue " + str(event.number), event) from error
 
-			event.time_out = event.time_out[3:]
-			event.time_out = event.time_out[0:5] + '.' + event.time_out[6:]
+		if observer is not None:
+			observer.cue_rendered("vtt", event)
 
-			webvtt_content.append(event.time_in + " --> " + event.time_out + '\n')
-			voiceover = event.voice_over 
-			voiceover = voiceover.replace('>','&gt;') # Escape any '>' characters
-			webvtt_content.append(voiceover + '\n\n')
-		except:
-			print("Problem at: ")
-			print(event)
-	
-	# Remove any trailing newlines from the last event
-	x:str = webvtt_content.pop().strip()
-	webvtt_content.append(x)
+	if observer is not None:
+		observer.stage_end("vtt")
 
-	with open(output_filename, "w") as output_file:
+	with open_file(output_filename, "w") as output_file:
 		for line in webvtt_content:
 			output_file.write(line)
 
 
-def write_adxml(output_filename:str, ad_script:list[AdEvent], metadata:AdMetaData, start_from:int = 1, collapse_lines:bool = False):
+def write_adxml(output_filename:str, ad_script:list[AdEvent], metadata:AdMetaData, start_from:int = 1, collapse_lines:bool = False, observer:AdObserver = None):
 
 	""" ADXML (Audio Description XML, a custom XML Grammar) Output """
 
 	xml_content:list[str] = []
+	count:int = start_from
 
 	xml_content.append("<script>")
 
+	if observer is not None:
+		observer.stage_start("adxml", len(ad_script))
+
 	# Write cues
 	for event in ad_script:
+		if observer is not None and observer.cancelled():
+			raise AdCancelled("Cancelled at cue " + str(event.number), event)
+
 		try:
 			voiceover = event.voice_over 
 			voiceover = voiceover.replace('>','&gt;') # Escape any '>' characters
@@ -701,16 +1142,23 @@ def write_adxml(output_filename:str, ad_script:list[AdEvent], metadata:AdMetaDat
 
 			count += 1
 
-		except:
-			print("Problem at: ")
-			print(event)
+		except Exception as error:
+			raise AdError("Problem at cue " + str(event.number), event) from error
+
+		if observer is not None:
+			observer.cue_rendered("adxml", event)
+
 	xml_content.append("</script>")
-	with open(output_filename, "w") as output_file:
-		for line in html_content:
+
+	if observer is not None:
+		observer.stage_end("adxml")
+
+	with open_file(output_filename, "w") as output_file:
+		for line in xml_content:
 			output_file.write(line)
 
 
-def write_html(output_filename:str, ad_script:list[AdEvent], metadata:AdMetaData, start_from:int = 1, collapse_lines:bool = False):
+def write_html(output_filename:str, ad_script:list[AdEvent], metadata:AdMetaData, start_from:int = 1, collapse_lines:bool = False, observer:AdObserver = None):
 	""" HTML output """
 
 	html_content:list[str] = []
@@ -750,8 +1198,14 @@ header { margin-bottom: 2em; text-align: center; }
 	else:
 		html_content.append("<h1>Script</h1>")
 
+	if observer is not None:
+		observer.stage_start("html", len(ad_script))
+
 	# Write cues
 	for event in ad_script:
+		if observer is not None and observer.cancelled():
+			raise AdCancelled("Cancelled at cue " + str(event.number), event)
+
 		try:
 			voiceover = event.voice_over 
 			voiceover = voiceover.replace('>','&gt;') # Escape any '>' characters
@@ -773,18 +1227,24 @@ header { margin-bottom: 2em; text-align: center; }
 
 			count += 1
 
-		except:
-			print("Problem at: ")
-			print(event)
+		except Exception as error:
+			raise AdError("Problem at cue " + str(event.number), event) from error
+
+		if observer is not None:
+			observer.cue_rendered("html", event)
 
 
 	html_content.append("</body>\n</html>")
-	with open(output_filename, "w") as output_file:
+
+	if observer is not None:
+		observer.stage_end("html")
+
+	with open_file(output_filename, "w") as output_file:
 		for line in html_content:
 			output_file.write(line)
 
 
-def write_markdown(output_filename:str, ad_script:list[AdEvent], metadata:AdMetaData, collapse_lines:bool = False):
+def write_markdown(output_filename:str, ad_script:list[AdEvent], metadata:AdMetaData, collapse_lines:bool = False, observer:AdObserver = None):
 
 	""" Text output, cues only """
 
@@ -799,7 +1259,13 @@ def write_markdown(output_filename:str, ad_script:list[AdEvent], metadata:AdMeta
 	count = 0
 
 	# Write cues
+	if observer is not None:
+		observer.stage_start("md", len(ad_script))
+
 	for event in ad_script:
+		if observer is not None and observer.cancelled():
+			raise AdCancelled("Cancelled at cue " + str(event.number), event)
+
 		try:
 			voiceover = event.voice_over 
 
@@ -813,12 +1279,1414 @@ def write_markdown(output_filename:str, ad_script:list[AdEvent], metadata:AdMeta
 
 			count += 1
 
-		except:
-			print("Problem at: ")
-			print(event)
-			exit()
+		except Exception as error:
+			raise AdError("Problem at cue " + str(event.number), event) from error
+
+		if observer is not None:
+			observer.cue_rendered("md", event)
 
-	with open(output_filename, "w") as output_file:
+	if observer is not None:
+		observer.stage_end("md")
+
+	with open_file(output_filename, "w") as output_file:
 		for line in content:
 			output_file.write(line)
 
+
+
+# Output formats, in the order they are written: name -> (file suffix, writer)
+OUTPUT_FORMATS = {
+	"csv": (".csv", lambda filename, ad_script, metadata, observer: write_csv(filename, ad_script, observer=observer)),
+	"vtt": (".vtt", lambda filename, ad_script, metadata, observer: write_webvtt(filename, ad_script, metadata, observer=observer)),
+	"words": ("-Words.vtt", lambda filename, ad_script, metadata, observer: write_webvtt(filename, ad_script, metadata, observer=observer, word_timing=True)),
+	"rtf": (".rtf", lambda filename, ad_script, metadata, observer: write_rtf(filename, ad_script, metadata, observer=observer)),
+	"html": (".html", lambda filename, ad_script, metadata, observer: write_html(filename, ad_script, metadata, observer=observer)),
+	"srt": (".srt", lambda filename, ad_script, metadata, observer: write_srt(filename, ad_script, observer=observer)),
+	# Kyle no like numbered cues
+	"kyle": ("-Cues.rtf", lambda filename, ad_script, metadata, observer: write_kyle(filename, ad_script, metadata, False, True, observer)),
+	"md": (".md", lambda filename, ad_script, metadata, observer: write_markdown(filename, ad_script, metadata, False, observer)),
+}
+
+
+def write_format(fmt:str, filename:str, ad_script:list[AdEvent], metadata:AdMetaData = None, ext:str = "", observer:AdObserver = None, bundle:"AdBundle" = None) -> str:
+
+	"""
+	Write one output format. filename has no extension; the format's suffix
+	and then ext (eg: ".gz") are added to it. Returns the file written.
+
+	Given a bundle, the output goes into the bundle instead (and ext is ignored,
+	the bundle is compressed already). Returns the name of the entry.
+	"""
+
+	suffix, writer = OUTPUT_FORMATS[fmt]
+
+	if bundle is not None:
+		output_filename = os.path.basename(filename) + suffix
+		with bundle.open(output_filename) as output_file:
+			writer(output_file, ad_script, metadata, observer)
+	else:
+		output_filename = filename + suffix + ext
+		writer(output_filename, ad_script, metadata, observer)
+
+	return output_filename
+
+
+
+# =======================================
+
+#	Bundles (zip)
+
+# =======================================
+
+class HashingWriter(io.RawIOBase):
+
+	""" Pass writes through to another file, keeping a SHA-256 and size of what went by """
+
+	def __init__(self, raw):
+		self.raw = raw
+		self.digest = hashlib.sha256()
+		self.size:int = 0
+
+	def writable(self) -> bool:
+		return True
+
+	def write(self, data) -> int:
+		self.digest.update(data)
+		self.size += len(data)
+		return self.raw.write(data)
+
+	def close(self):
+		if not self.closed:
+			self.raw.close()
+		super().close()
+
+
+class AdBundle:
+
+	"""
+	A zip archive that the writers stream straight into, so there are no
+	intermediate files. On close, manifest.json is added, with the size and
+	SHA-256 of every entry and the metadata. If the with block fails, the
+	half-written archive is deleted instead.
+
+		with AdBundle("script.zip", metadata) as bundle:
+			write_format("vtt", "script", ad_script, metadata, bundle=bundle)
+	"""
+
+	def __init__(self, output_filename:str, metadata:AdMetaData = None):
+		self.output_filename = output_filename
+		try:
+			self.archive = zipfile.ZipFile(output_filename, "w", zipfile.ZIP_DEFLATED)
+		except OSError as error:
+			raise AdError("Unable to write file " + output_filename) from error
+		self.metadata = metadata
+		self.entries:list[tuple[str, HashingWriter]] = []
+
+	def open(self, name:str):
+
+		""" Open a new entry for writing, as text """
+
+		info = zipfile.ZipInfo(name, localtime()[:6])
+		info.compress_type = zipfile.ZIP_DEFLATED
+
+		raw = HashingWriter(self.archive.open(info, "w"))
+		self.entries.append((name, raw))
+
+		return io.TextIOWrapper(io.BufferedWriter(raw))
+
+	def close(self):
+
+		manifest:dict = {"files": []}
+
+		for name, raw in self.entries:
+			manifest["files"].append({"name": name, "size": raw.size, "sha256": raw.digest.hexdigest()})
+
+		if self.metadata is not None:
+			manifest["metadata"] = self.metadata.__dict__
+
+		self.archive.writestr("manifest.json", json.dumps(manifest, indent=1))
+		self.archive.close()
+
+	def __enter__(self):
+		return self
+
+	def discard(self):
+
+		""" Throw the archive away, eg: after a writer failed part way through """
+
+		for name, raw in self.entries:
+			try:
+				raw.close()
+			except Exception:
+				pass
+
+		try:
+			self.archive.close()
+		except Exception:
+			pass
+
+		if os.path.exists(self.output_filename):
+			os.remove(self.output_filename)
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		if exc_type is None:
+			self.close()
+		else:
+			self.discard()
+
+
+
+# =======================================
+
+#	Series builds
+
+# =======================================
+
+@dataclass
+class AdEpisode:
+
+	""" Class for encapsulating one episode of a series manifest """
+
+	script: str = ""
+	metadata: AdMetaData = field(default_factory=AdMetaData)
+
+
+@dataclass
+class AdSeries:
+
+	""" Class for encapsulating a series manifest: what to build, and where """
+
+	formats: list = field(default_factory=list)
+	output_dir: str = "."
+	compression: str = ""
+	episodes: list = field(default_factory=list)
+
+
+def load_manifest(input_filename:str) -> AdSeries:
+
+	"""
+	Read a series manifest (TOML). Something like:
+
+		formats = ["vtt", "srt", "md"]
+		output_dir = "build"
+		compression = "gz"      # optional
+
+		[metadata]              # defaults for every episode
+		author = "Brett Coulstock"
+		...
+
+		[[episode]]
+		script = "script_01.srt"
+		title = "Episode 1"     # anything else overrides [metadata]
+
+	Paths are relative to the manifest. An episode's filename defaults to
+	the name of its script.
+	"""
+
+	try:
+		with open(input_filename, "r") as read_file:
+			data = toml.load(read_file)
+	except (OSError, ValueError) as error:
+		raise AdError("Unable to open file " + input_filename) from error
+
+	base_dir = os.path.dirname(os.path.abspath(input_filename))
+
+	series = AdSeries()
+	series.formats = data.get("formats", [])
+	series.output_dir = os.path.join(base_dir, data.get("output_dir", "."))
+	series.compression = data.get("compression", "")
+	if series.compression and "." + str(series.compression) not in COMPRESSORS:
+		raise AdError("Unknown compression " + repr(series.compression) + " in " + input_filename
+			+ " (use " + ", ".join(extension[1:] for extension in COMPRESSORS) + ")")
+
+	defaults = data.get("metadata", {})
+
+	for entry in data.get("episode", []):
+		episode = AdEpisode()
+		episode.script = os.path.join(base_dir, entry["script"])
+
+		fields = dict(defaults)
+		fields["filename"] = os.path.basename(entry["script"]).split(".")[0]
+		fields.update(entry)
+		episode.metadata.set_metadata(fields)
+
+		series.episodes.append(episode)
+
+	return series
+
+
+_library_hash:str = ""
+
+def get_library_hash() -> str:
+
+	""" Hash of this file, so changes to adlib make every output stale """
+
+	global _library_hash
+
+	if _library_hash == "":
+		with open(__file__, "rb") as read_file:
+			_library_hash = hashlib.sha256(read_file.read()).hexdigest()
+
+	return _library_hash
+
+
+def get_episode_hash(episode:AdEpisode) -> str:
+
+	""" Hash everything an episode's outputs depend on: script, metadata and adlib """
+
+	digest = hashlib.sha256()
+
+	with open(episode.script, "rb") as read_file:
+		digest.update(read_file.read())
+
+	digest.update(json.dumps(episode.metadata.__dict__, sort_keys=True).encode())
+	digest.update(get_library_hash().encode())
+
+	return digest.hexdigest()
+
+
+def build_episode(script:str, metadata:AdMetaData, filename:str, formats:list, ext:str = "") -> list[str]:
+
+	""" Parse one script and write the given formats. Runs in a worker process. """
+
+	try:
+		with open_file(script, "r") as read_file:
+			lines = read_file.readlines()
+	except READ_ERRORS as error:
+		raise AdError("Unable to open file " + script) from error
+
+	ad_script = parse_srt(lines)
+
+	written:list[str] = []
+
+	for fmt in OUTPUT_FORMATS:
+		if fmt in formats:
+			written.append(write_format(fmt, filename, ad_script, metadata, ext))
+
+	return written
+
+
+def build_series(series:AdSeries, jobs:int = None, force:bool = False) -> list[str]:
+
+	"""
+	Rebuild the outputs of a series that are out of date, in parallel.
+
+	An output is out of date if it is missing, or if the hash of its script,
+	metadata and adlib differs from the one recorded when it was last built.
+	Hashes are kept in .adbuild.json in the output directory.
+	Returns the list of files written.
+	"""
+
+	state_filename = os.path.join(series.output_dir, ".adbuild.json")
+	state:dict = {}
+
+	try:
+		with open(state_filename, "r") as read_file:
+			state = json.load(read_file)
+	except (OSError, ValueError):
+		state = {}
+
+	ext = ""
+	if series.compression != "":
+		ext = "." + series.compression
+
+	# Work out what's stale
+
+	work = []
+
+	for episode in series.episodes:
+		key = get_episode_hash(episode)
+		filename = os.path.join(series.output_dir, episode.metadata.filename)
+
+		stale = []
+		for fmt, (suffix, writer) in OUTPUT_FORMATS.items():
+			if fmt not in series.formats:
+				continue
+			output_filename = filename + suffix + ext
+			if force or state.get(output_filename) != key or not os.path.exists(output_filename):
+				stale.append(fmt)
+
+		if len(stale) > 0:
+			work.append((key, episode, filename, stale))
+
+	if len(work) == 0:
+		return []
+
+	# Rebuild it
+
+	os.makedirs(series.output_dir, exist_ok=True)
+	written:list[str] = []
+
+	try:
+		with ProcessPoolExecutor(max_workers=jobs) as executor:
+			futures = []
+			for key, episode, filename, stale in work:
+				future = executor.submit(build_episode, episode.script, episode.metadata, filename, stale, ext)
+				futures.append((key, future))
+
+			for key, future in futures:
+				for output_filename in future.result():
+					state[output_filename] = key
+					written.append(output_filename)
+	finally:
+		# Record whatever did get built, even if something failed
+		with open(state_filename + ".tmp", "w") as output_file:
+			json.dump(state, output_file, indent=1, sort_keys=True)
+		os.replace(state_filename + ".tmp", state_filename)
+
+	return written
+
+
+
+# =======================================
+
+#	Corpus store (SQLite)
+
+# =======================================
+
+CORPUS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS scripts (
+	id INTEGER PRIMARY KEY,
+	filename TEXT UNIQUE NOT NULL,
+	hash TEXT NOT NULL,
+	title TEXT,
+	author TEXT,
+	subject TEXT,
+	keywords TEXT,
+	date TEXT,
+	licence TEXT,
+	rights TEXT,
+	url TEXT
+);
+
+CREATE TABLE IF NOT EXISTS cues (
+	id INTEGER PRIMARY KEY,
+	script_id INTEGER NOT NULL REFERENCES scripts(id),
+	number INTEGER NOT NULL,
+	time_in TEXT NOT NULL,
+	time_out TEXT NOT NULL,
+	duration TEXT NOT NULL,
+	start_ms INTEGER NOT NULL,
+	duration_ms INTEGER NOT NULL,
+	voice_over TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS cues_script ON cues(script_id, start_ms);
+CREATE INDEX IF NOT EXISTS cues_start ON cues(start_ms);
+CREATE INDEX IF NOT EXISTS cues_duration ON cues(duration_ms);
+
+CREATE TABLE IF NOT EXISTS directions (
+	cue_id INTEGER NOT NULL REFERENCES cues(id),
+	direction TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS directions_direction ON directions(direction, cue_id);
+CREATE INDEX IF NOT EXISTS directions_cue ON directions(cue_id);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS cues_fts USING fts5(voice_over, content='cues', content_rowid='id');
+"""
+
+
+def open_corpus(database:str) -> sqlite3.Connection:
+
+	""" Open (creating if need be) a corpus database """
+
+	connection = sqlite3.connect(database)
+	connection.execute("PRAGMA journal_mode = WAL")
+	connection.execute("PRAGMA synchronous = NORMAL")
+	connection.executescript(CORPUS_SCHEMA)
+
+	return connection
+
+
+def ingest_scripts(connection:sqlite3.Connection, scripts:list[tuple[str, AdMetaData]]) -> int:
+
+	"""
+	Load scripts, given as (SRT filename, metadata or None) pairs, into the corpus.
+	Scripts whose SRT and metadata haven't changed since they were last
+	ingested are skipped. Everything happens in one transaction.
+	Returns the number of scripts (re)loaded.
+	"""
+
+	count:int = 0
+
+	with connection:
+		for script_filename, metadata in scripts:
+			script_filename = os.path.abspath(script_filename)
+
+			digest = hashlib.sha256()
+			with open(script_filename, "rb") as read_file:
+				digest.update(read_file.read())
+			if metadata is not None:
+				digest.update(json.dumps(metadata.__dict__, sort_keys=True).encode())
+			key = digest.hexdigest()
+
+			row = connection.execute("SELECT id, hash FROM scripts WHERE filename = ?", (script_filename,)).fetchone()
+
+			if row is not None:
+				if row[1] == key:
+					continue
+
+				# Changed: throw the old version away
+				script_id = row[0]
+				connection.execute("""INSERT INTO cues_fts(cues_fts, rowid, voice_over)
+					SELECT 'delete', id, voice_over FROM cues WHERE script_id = ?""", (script_id,))
+				connection.execute("DELETE FROM directions WHERE cue_id IN (SELECT id FROM cues WHERE script_id = ?)", (script_id,))
+				connection.execute("DELETE FROM cues WHERE script_id = ?", (script_id,))
+				connection.execute("DELETE FROM scripts WHERE id = ?", (script_id,))
+
+			if metadata is None:
+				metadata = AdMetaData()
+
+			script_id = connection.execute("""INSERT INTO scripts
+				(filename, hash, title, author, subject, keywords, date, licence, rights, url)
+				VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+				(script_filename, key, metadata.title, metadata.author, metadata.subject,
+				metadata.keywords, metadata.date, metadata.licence, metadata.rights, metadata.url)).lastrowid
+
+			try:
+				with open_file(script_filename, "r") as read_file:
+					lines = read_file.readlines()
+			except READ_ERRORS as error:
+				raise AdError("Unable to open file " + script_filename) from error
+
+			ad_script = parse_srt(lines)
+
+			# Hand out cue ids ourselves, so directions can refer to them
+			cue_id = connection.execute("SELECT COALESCE(MAX(id), 0) FROM cues").fetchone()[0]
+			cue_rows = []
+			direction_rows = []
+
+			for event in ad_script:
+				cue_id += 1
+				start = time_to_ms(event.time_in)
+				cue_rows.append((cue_id, script_id, event.number, event.time_in, event.time_out,
+					event.duration, start, time_to_ms(event.time_out) - start, event.voice_over))
+				for direction in event.direction:
+					direction_rows.append((cue_id, direction.strip("[]").upper()))
+
+			connection.executemany("INSERT INTO cues VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", cue_rows)
+			connection.executemany("INSERT INTO directions VALUES (?, ?)", direction_rows)
+			connection.execute("""INSERT INTO cues_fts(rowid, voice_over)
+				SELECT id, voice_over FROM cues WHERE script_id = ?""", (script_id,))
+
+			count += 1
+
+	return count
+
+
+def search_cues(connection:sqlite3.Connection, text:str = None, direction:str = None, min_duration:float = None, script:str = None, raw:bool = False) -> list[tuple[str, AdEvent]]:
+
+	"""
+	Search the corpus. All of these are optional, and are combined:
+
+	text         - words to find in the voice-over, eg: "Doctor's TARDIS"
+	direction    - cues with a direction starting with this, eg: "FAST" (matches [FAST-ish] too)
+	min_duration - cues longer than this many seconds
+	script       - glob pattern on the script's filename, eg: "*S02*"
+	raw          - text is an FTS5 query, eg: "TARDIS OR Dalek*"
+
+	Returns (script filename, cue) pairs in script and time order.
+	"""
+
+	sql = """SELECT scripts.filename, cues.number, cues.time_in, cues.time_out, cues.duration, cues.voice_over
+		FROM cues JOIN scripts ON scripts.id = cues.script_id"""
+	conditions:list[str] = []
+	parameters:list = []
+
+	if text is not None and (raw or text.strip() != ""):
+		conditions.append("cues.id IN (SELECT rowid FROM cues_fts WHERE cues_fts MATCH ?)")
+		if not raw:
+			text = " ".join('"' + word.replace('"', '""') + '"' for word in text.split())
+		parameters.append(text)
+
+	if direction is not None:
+		conditions.append("cues.id IN (SELECT cue_id FROM directions WHERE direction GLOB ?)")
+		parameters.append(direction.strip("[]").upper() + "*")
+
+	if min_duration is not None:
+		conditions.append("cues.duration_ms > ?")
+		parameters.append(int(min_duration * 1000))
+
+	if script is not None:
+		conditions.append("scripts.filename GLOB ?")
+		parameters.append(script)
+
+	if len(conditions) > 0:
+		sql += " WHERE " + " AND ".join(conditions)
+
+	sql += " ORDER BY scripts.filename, cues.start_ms"
+
+	results:list[tuple[str, AdEvent]] = []
+
+	try:
+		rows = connection.execute(sql, parameters).fetchall()
+	except sqlite3.OperationalError as error:
+		raise AdError("Bad search: " + str(error)) from error
+
+	for row in rows:
+		event = AdEvent(number=row[1], time_in=row[2], time_out=row[3], duration=row[4], voice_over=row[5])
+		event.direction = re.findall(r"(\[[^]]*\])", event.voice_over, re.MULTILINE)
+		results.append((row[0], event))
+
+	return results
+
+
+
+# =======================================
+
+#	Editing
+
+# =======================================
+
+def create_event(time_in:str, time_out:str, voice_over:str) -> AdEvent:
+
+	""" Make a new cue, working out its duration and directions as parse_srt would """
+
+	event = AdEvent(time_in=time_in, time_out=time_out, voice_over=voice_over)
+	event.duration = get_duration(time_in, time_out)
+	event.direction = re.findall(r"(\[[^]]*\])", voice_over, re.MULTILINE)
+
+	return event
+
+
+class AdScript:
+
+	"""
+	An editable script. Cues live in a list of chunks, so inserting or
+	deleting near the top of a long script only shuffles one chunk.
+	Every edit is journalled, so it can be undone.
+
+	Cues are numbered by their position, so there's no renumbering to do.
+	Treat the cues as read-only: edit through these methods, which replace
+	cues rather than changing them, so export() can tell what changed.
+	"""
+
+	CHUNK_SIZE = 64
+
+	def __init__(self, ad_script:list[AdEvent] = None):
+
+		events = list(ad_script or [])
+
+		self.chunks:list[list[AdEvent]] = [events[i:i + self.CHUNK_SIZE] for i in range(0, len(events), self.CHUNK_SIZE)]
+		if len(self.chunks) == 0:
+			self.chunks.append([])
+
+		self.length:int = len(events)
+		self.journal:list[list[tuple]] = []
+		self.exports:dict = {}
+
+	def __len__(self) -> int:
+		return self.length
+
+	def __iter__(self):
+		for chunk in self.chunks:
+			yield from chunk
+
+	def __getitem__(self, position:int) -> AdEvent:
+		i, offset = self.locate(position)
+		return self.chunks[i][offset]
+
+	def get_index(self, position:int, inserting:bool = False) -> int:
+
+		"""
+		Turn a position, which can count back from the end as with lists, into
+		an index from the start, so edits (and their undos) stay put.
+		Inserting can also go at the very end.
+		"""
+
+		index = position + self.length if position < 0 else position
+
+		if not 0 <= index < self.length + inserting:
+			raise IndexError("No cue at position " + str(position))
+
+		return index
+
+	def locate(self, position:int) -> tuple[int, int]:
+
+		""" Find which chunk a position is in, and where in the chunk """
+
+		offset = self.get_index(position)
+
+		for i, chunk in enumerate(self.chunks):
+			if offset < len(chunk):
+				return i, offset
+			offset -= len(chunk)
+
+		raise IndexError("No cue at position " + str(position))
+
+	# ... The three edits everything else is made of
+
+	def _insert(self, position:int, event:AdEvent):
+
+		if position == self.length:
+			i = len(self.chunks) - 1
+			offset = len(self.chunks[i])
+		else:
+			i, offset = self.locate(position)
+
+		chunk = self.chunks[i]
+		chunk.insert(offset, event)
+		self.length += 1
+
+		if len(chunk) > 2 * self.CHUNK_SIZE:
+			self.chunks[i:i + 1] = [chunk[:self.CHUNK_SIZE], chunk[self.CHUNK_SIZE:]]
+
+	def _delete(self, position:int) -> AdEvent:
+
+		i, offset = self.locate(position)
+		event = self.chunks[i].pop(offset)
+		self.length -= 1
+
+		if len(self.chunks[i]) == 0 and len(self.chunks) > 1:
+			del self.chunks[i]
+
+		return event
+
+	def _replace(self, position:int, event:AdEvent) -> AdEvent:
+
+		i, offset = self.locate(position)
+		old = self.chunks[i][offset]
+		self.chunks[i][offset] = event
+
+		return old
+
+	def _apply(self, edits:list[tuple]) -> list[tuple]:
+
+		""" Apply ("insert", position, cue), ("delete", position) and ("replace", position, cue) edits. Returns the edits that undo them. """
+
+		undo:list[tuple] = []
+
+		for edit in edits:
+			if edit[0] == "insert":
+				self._insert(edit[1], edit[2])
+				undo.append(("delete", edit[1]))
+			elif edit[0] == "delete":
+				undo.append(("insert", edit[1], self._delete(edit[1])))
+			else:
+				undo.append(("replace", edit[1], self._replace(edit[1], edit[2])))
+
+		undo.reverse()
+		return undo
+
+	def edit(self, edits:list[tuple]):
+		self.journal.append(self._apply(edits))
+
+	def undo(self) -> bool:
+
+		""" Undo the last edit. Returns False if there was nothing to undo. """
+
+		if len(self.journal) == 0:
+			return False
+
+		self._apply(self.journal.pop())
+		return True
+
+	# ... Edits
+
+	def insert(self, position:int, event:AdEvent):
+		self.edit([("insert", self.get_index(position, True), event)])
+
+	def delete(self, position:int):
+		self.edit([("delete", self.get_index(position))])
+
+	def retime(self, position:int, time_in:str, time_out:str):
+
+		position = self.get_index(position)
+
+		if time_to_ms(time_out) < time_to_ms(time_in):
+			raise AdError("Can't retime cue " + str(position + 1) + " to end (" + time_out + ") before it starts (" + time_in + ")", self[position])
+
+		self.edit([("replace", position, create_event(time_in, time_out, self[position].voice_over))])
+
+	def split(self, position:int, time:str, text_position:int = None):
+
+		"""
+		Split a cue in two at time. The text is split at text_position, or if
+		that's not given, at the space nearest the same fraction of the way through.
+		"""
+
+		position = self.get_index(position)
+		event = self[position]
+		text = event.voice_over
+
+		if not time_to_ms(event.time_in) < time_to_ms(time) < time_to_ms(event.time_out):
+			raise AdError("Can't split cue " + str(position + 1) + " at " + time + ", it runs from " + event.time_in + " to " + event.time_out, event)
+
+		if text_position is None:
+			fraction = (time_to_ms(time) - time_to_ms(event.time_in)) / max(1, time_to_ms(event.time_out) - time_to_ms(event.time_in))
+			middle = int(len(text) * fraction)
+			spaces = [i for i, c in enumerate(text) if c.isspace()]
+			text_position = min(spaces, key=lambda i: abs(i - middle)) if len(spaces) > 0 else middle
+
+		self.edit([
+			("replace", position, create_event(event.time_in, time, text[:text_position].strip())),
+			("insert", position + 1, create_event(time, event.time_out, text[text_position:].strip())),
+		])
+
+	def merge(self, position:int):
+
+		""" Merge a cue with the one after it """
+
+		position = self.get_index(position)
+		first = self[position]
+		second = self[position + 1]
+
+		self.edit([
+			("replace", position, create_event(first.time_in, second.time_out, first.voice_over + "\n" + second.voice_over)),
+			("delete", position + 1),
+		])
+
+	# ... Output
+
+	def export(self, fmt:str, output_filename:str, metadata:AdMetaData = None) -> int:
+
+		"""
+		Write the script as "srt", "vtt" or "csv", the same as write_srt,
+		write_webvtt or write_csv would. The first export writes the whole
+		file. After that, only cues that changed are rendered again, and the
+		file is only rewritten from the first byte that changed.
+		Returns the number of bytes written.
+		"""
+
+		if fmt not in ("srt", "vtt", "csv"):
+			raise AdError("Can't export " + fmt + " from an editable script")
+
+		if output_filename.endswith(tuple(COMPRESSORS)):
+			raise AdError("Can't export to a compressed file from an editable script: " + output_filename)
+
+		encoding = locale.getpreferredencoding(False)
+		cache, previous = self.exports.get((fmt, output_filename), ({}, []))
+		new_cache:dict = {}
+		fragments:list[bytes] = []
+
+		if fmt == "vtt":
+			fragments.append(render_webvtt_header(metadata).replace("\n", os.linesep).encode(encoding))
+
+		for i, event in enumerate(self):
+			last = i == self.length - 1
+			number = i + 1
+
+			# Webvtt cues don't carry a number, so they survive being moved
+			key = (id(event), last) if fmt == "vtt" else (id(event), number, last)
+
+			hit = cache.get(key)
+			if hit is not None and hit[0] is event:
+				fragment = hit[1]
+			else:
+				if fmt == "srt":
+					text = render_srt_cue(event, number, last)
+				elif fmt == "vtt":
+					text = render_webvtt_cue(event, last)
+				else:
+					text = render_csv_cue(event, number)
+				fragment = text.replace("\n", os.linesep).encode(encoding)
+
+			new_cache[key] = (event, fragment)
+			fragments.append(fragment)
+
+		# Find the first thing that changed
+		first = 0
+		while first < min(len(fragments), len(previous)) and (fragments[first] is previous[first] or fragments[first] == previous[first]):
+			first += 1
+
+		offset = sum(len(fragment) for fragment in fragments[:first])
+		data = b"".join(fragments[first:])
+
+		if len(previous) > 0 and os.path.exists(output_filename) and os.path.getsize(output_filename) == sum(len(fragment) for fragment in previous):
+			with open(output_filename, "r+b") as output_file:
+				output_file.seek(offset)
+				output_file.write(data)
+				output_file.truncate()
+		else:
+			data = b"".join(fragments)
+			with open(output_filename, "wb") as output_file:
+				output_file.write(data)
+
+		self.exports[(fmt, output_filename)] = (new_cache, fragments)
+
+		return len(data)
+
+
+
+# =======================================
+
+#	Random access (sidecar index)
+
+# =======================================
+
+# The sidecar index is binary, so a lookup only reads the records it needs:
+# a header, then one fixed-width record per cue of (start ms, byte offset, length)
+INDEX_MAGIC = b"ADIDX001"
+INDEX_HEADER = struct.Struct("<8sqqq?")	# magic, SRT size, SRT mtime_ns, cue count, in order?
+INDEX_RECORD = struct.Struct("<qqq")
+
+
+@dataclass
+class AdIndex:
+
+	"""
+	Class for encapsulating a byte-offset index of an SRT file, so cues can be
+	read without parsing the whole file. Cue n (counting from 1, as parse_srt
+	does) is record n-1: its start time, where it starts in the file and how
+	many bytes long it is. Kept next to the SRT file as filename.idx, and
+	rebuilt if the SRT changes.
+	"""
+
+	filename: str = ""
+	size: int = 0
+	mtime_ns: int = 0
+	count: int = 0
+	in_order: bool = True	# Are the cues in time order?
+	records: io.IOBase = None	# The index file (or a copy of it in memory), records are read as needed
+
+	def __len__(self) -> int:
+		return self.count
+
+	def build(self):
+
+		""" Index the SRT file in one pass """
+
+		if not self.filename.lower().endswith(".srt"):
+			raise AdError("Only plain .srt files can be indexed: " + self.filename)
+
+		data = bytearray(INDEX_HEADER.size)
+		self.count = 0
+		self.in_order = True
+
+		in_cue = False
+		start = offset = previous = position = 0
+
+		with open(self.filename, "rb") as read_file:
+			stat = os.fstat(read_file.fileno())
+			self.size = stat.st_size
+			self.mtime_ns = stat.st_mtime_ns
+
+			for line in read_file:
+				if b"-->" in line:
+					if in_cue:
+						data += INDEX_RECORD.pack(start, offset, position - offset)
+
+					try:
+						start = time_to_ms(line.strip()[0:12].decode())
+					except ValueError as error:
+						raise AdError("Unable to read the times of cue " + str(self.count + 1) + ": " + line.decode(errors="replace").strip()) from error
+
+					if start < previous:
+						self.in_order = False
+					previous = start
+
+					offset = position
+					in_cue = True
+					self.count += 1
+				elif in_cue and line.strip() == b"":
+					data += INDEX_RECORD.pack(start, offset, position + len(line) - offset)
+					in_cue = False
+
+				position += len(line)
+
+		if in_cue:
+			data += INDEX_RECORD.pack(start, offset, position - offset)
+
+		self.close()
+		self.records = io.BytesIO(data)
+
+	def save(self):
+
+		""" Write filename.idx. It's written to one side first, so nobody reads half an index. """
+
+		self.records.seek(INDEX_HEADER.size)
+		data = self.records.read()
+
+		with open(self.filename + ".idx.tmp", "wb") as output_file:
+			output_file.write(INDEX_HEADER.pack(INDEX_MAGIC, self.size, self.mtime_ns, self.count, self.in_order))
+			output_file.write(data)
+
+		os.replace(self.filename + ".idx.tmp", self.filename + ".idx")
+
+	def close(self):
+
+		if self.records is not None:
+			self.records.close()
+			self.records = None
+
+	def is_stale(self) -> bool:
+
+		stat = os.stat(self.filename)
+		return stat.st_size != self.size or stat.st_mtime_ns != self.mtime_ns
+
+	def get_record(self, i:int) -> tuple[int, int, int]:
+
+		""" (start ms, byte offset, length) of cue i+1 """
+
+		self.records.seek(INDEX_HEADER.size + i * INDEX_RECORD.size)
+		return INDEX_RECORD.unpack(self.records.read(INDEX_RECORD.size))
+
+	def find_start(self, ms:int) -> int:
+
+		""" Binary search for the first cue starting at or after ms (cues must be in order) """
+
+		low, high = 0, self.count
+		while low < high:
+			middle = (low + high) // 2
+			if self.get_record(middle)[0] < ms:
+				low = middle + 1
+			else:
+				high = middle
+
+		return low
+
+	def get_cues(self, first:int, last:int) -> list[AdEvent]:
+
+		""" Read cues first to last (inclusive, counting from 1) """
+
+		if self.is_stale():
+			self.build()
+			self.save()
+
+		first = max(first, 1)
+		last = min(last, self.count)
+
+		if first > last:
+			return []
+
+		# The cues are next to each other in the file, so it's just one read
+		start = self.get_record(first - 1)[1]
+		_, offset, length = self.get_record(last - 1)
+
+		with open(self.filename, "rb") as read_file:
+			read_file.seek(start)
+			text = read_file.read(offset + length - start).decode(locale.getpreferredencoding(False))
+
+		# parse_srt gives an empty cue for every extra blank line, so drop those,
+		# and number the rest from first
+		ad_script = [event for event in parse_srt(text.splitlines(keepends=True)) if event.time_in != ""]
+
+		for event in ad_script:
+			event.number += first - 1
+
+		return ad_script
+
+	def get_cues_between(self, start:str, end:str) -> list[AdEvent]:
+
+		"""
+		Read the cues starting at or after start and before end (SRT times).
+		If the cues aren't in time order, every record has to be checked.
+		"""
+
+		if self.is_stale():
+			self.build()
+			self.save()
+
+		start_ms = time_to_ms(start)
+		end_ms = time_to_ms(end)
+
+		if self.in_order:
+			return self.get_cues(self.find_start(start_ms) + 1, self.find_start(end_ms))
+
+		self.records.seek(INDEX_HEADER.size)
+		records = self.records.read(self.count * INDEX_RECORD.size)
+
+		ad_script:list[AdEvent] = []
+		for i, (cue_start, offset, length) in enumerate(INDEX_RECORD.iter_unpack(records)):
+			if start_ms <= cue_start < end_ms:
+				ad_script += self.get_cues(i + 1, i + 1)
+
+		return ad_script
+
+
+def load_index(srt_filename:str, rebuild:bool = False) -> AdIndex:
+
+	"""
+	Open the sidecar index for an SRT file, (re)building it if it's missing or
+	out of date. Only the header is read; records are read as they're needed.
+	"""
+
+	index = AdIndex(srt_filename)
+
+	if not rebuild:
+		try:
+			index.records = open(srt_filename + ".idx", "rb")
+			magic, index.size, index.mtime_ns, index.count, index.in_order = INDEX_HEADER.unpack(index.records.read(INDEX_HEADER.size))
+			if magic != INDEX_MAGIC or os.fstat(index.records.fileno()).st_size != INDEX_HEADER.size + index.count * INDEX_RECORD.size:
+				rebuild = True
+		except (OSError, struct.error):
+			rebuild = True
+
+	if rebuild or index.is_stale():
+		index.build()
+		index.save()
+
+	return index
+
+
+
+# =======================================
+
+#	Fitting around dialogue
+
+# =======================================
+
+@dataclass
+class AdGap:
+
+	""" Class for encapsulating how an AD cue sits against the dialogue. Times are in ms. """
+
+	event: AdEvent = field(default_factory=AdEvent)
+	collisions: list = field(default_factory=list)	# Dialogue events the cue talks over
+	gap_start: int = 0	# The free window the cue starts in (empty if it starts in dialogue)
+	gap_end: int = 0
+	suggestion: int = -1	# Nearest start time where the cue fits without a clash, -1 if nowhere
+
+
+def find_gaps(ad_script:list[AdEvent], dialogue:list[AdEvent]) -> list[AdGap]:
+
+	"""
+	Sweep the AD cues against the dialogue (both parsed SRT files).
+
+	Dialogue is sorted and overlapping lines merged into blocks, which leaves
+	the free windows in between. Each cue is then found among the blocks, and
+	the nearest window it fits in, by binary search, so the whole thing is O(n log n).
+	"""
+
+	lines = sorted(dialogue, key=lambda line: time_to_ms(line.time_in))
+
+	# Merge the dialogue into busy blocks: [start, end, first line, last line + 1]
+	blocks:list[list] = []
+
+	for i, line in enumerate(lines):
+		start = time_to_ms(line.time_in)
+		end = time_to_ms(line.time_out)
+
+		if len(blocks) > 0 and start < blocks[-1][1]:
+			blocks[-1][1] = max(blocks[-1][1], end)
+			blocks[-1][3] = i + 1
+		else:
+			blocks.append([start, end, i, i + 1])
+
+	block_ends = [block[1] for block in blocks]
+
+	# Free window i runs from the end of block i-1 to the start of block i
+	windows:list[tuple[int, int]] = []
+	previous_end = 0
+
+	for block in blocks:
+		windows.append((previous_end, block[0]))
+		previous_end = block[1]
+
+	windows.append((previous_end, sys.maxsize))
+
+	# Sparse table: longest[k][i] is the longest window in windows[i : i + 2**k],
+	# which lets us find the nearest window that's long enough in O(log n)
+	longest:list[list[int]] = [[window[1] - window[0] for window in windows]]
+
+	while 2 ** len(longest) <= len(windows):
+		previous = longest[-1]
+		step = 2 ** (len(longest) - 1)
+		longest.append([max(previous[i], previous[i + step]) for i in range(len(previous) - step)])
+
+	def first_fit(i:int, duration:int) -> int:
+
+		""" First window from i onwards at least duration long (len(windows) if none) """
+
+		for k in range(len(longest) - 1, -1, -1):
+			if i < len(longest[k]) and longest[k][i] < duration:
+				i += 2 ** k
+		return i
+
+	def last_fit(i:int, duration:int) -> int:
+
+		""" Last window from i backwards at least duration long (-1 if none) """
+
+		for k in range(len(longest) - 1, -1, -1):
+			if i - 2 ** k + 1 >= 0 and longest[k][i - 2 ** k + 1] < duration:
+				i -= 2 ** k
+		return i
+
+	gaps:list[AdGap] = []
+
+	for event in ad_script:
+		start = time_to_ms(event.time_in)
+		end = time_to_ms(event.time_out)
+		gap = AdGap(event)
+
+		# First block that ends after the cue starts
+		i = bisect_right(block_ends, start)
+
+		# ... everything it overlaps
+		j = i
+		while j < len(blocks) and blocks[j][0] < end:
+			for line in lines[blocks[j][2]:blocks[j][3]]:
+				if time_to_ms(line.time_in) < end and time_to_ms(line.time_out) > start:
+					gap.collisions.append(line)
+			j += 1
+
+		# ... the window it starts in
+		if i == len(blocks) or start < blocks[i][0]:
+			gap.gap_start, gap.gap_end = windows[i]
+		else:
+			gap.gap_start = gap.gap_end = start
+
+		# ... and the nearest window it would fit in, looking both ways
+		duration = end - start
+		best = -1
+
+		for k in (i, first_fit(i + 1, duration), last_fit(i - 1, duration)):
+			if 0 <= k < len(windows) and windows[k][1] - windows[k][0] >= duration:
+				placed = min(max(start, windows[k][0]), windows[k][1] - duration)
+				if best == -1 or abs(placed - start) < abs(best - start):
+					best = placed
+
+		gap.suggestion = best
+		gaps.append(gap)
+
+	return gaps
+
+
+
+# =======================================
+
+#	Near duplicates (MinHash)
+
+# =======================================
+
+# 8 bands of 4 rows: pairs of cues about 60% alike or better land in the same bucket
+MINHASH_BANDS = 8
+MINHASH_ROWS = 4
+SHINGLE_SIZE = 4
+
+
+def get_shingles(voiceover:str) -> set:
+
+	""" Break a voice-over into overlapping runs of characters, ignoring case, punctuation and directions """
+
+	text = re.sub(r"\[[^]]*\]", " ", voiceover.lower())
+	text = " ".join(re.sub(r"[^\w\s]", " ", text).split())
+
+	if len(text) <= SHINGLE_SIZE:
+		return {text} if text != "" else set()
+
+	return {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+
+def get_shingle_hashes(shingle:str) -> tuple:
+
+	""" The hashes of one shingle. Each blake2b digest gives 16 32-bit hashes at once. """
+
+	data = shingle.encode()
+	values:tuple = ()
+
+	for salt in range(MINHASH_BANDS * MINHASH_ROWS // 16):
+		values += struct.unpack("<16I", hashlib.blake2b(data, digest_size=64, salt=bytes([salt])).digest())
+
+	return values
+
+
+def get_minhash(shingles:set, known:dict = None) -> tuple:
+
+	"""
+	MinHash signature of a set of shingles. Shingles repeat a lot across a
+	corpus, so pass the same dictionary as known to hash each one only once.
+	"""
+
+	if known is None:
+		known = {}
+
+	for shingle in shingles - known.keys():
+		known[shingle] = get_shingle_hashes(shingle)
+
+	return tuple(map(min, zip(*map(known.__getitem__, shingles))))
+
+
+def find_duplicates(cues:list[tuple[str, AdEvent]], threshold:float = 0.8) -> list[list[tuple[str, AdEvent]]]:
+
+	"""
+	Find clusters of near-identical cues, given (script filename, cue) pairs.
+
+	Cues sharing a band of their MinHash signature land in the same bucket.
+	Each bucket is only checked against its first member (by the Jaccard
+	similarity of their shingles), so the work grows with the number of cues,
+	not the number of pairs. Returns the clusters, biggest first.
+	"""
+
+	shingles = [get_shingles(event.voice_over) for filename, event in cues]
+	signatures:dict = {}	# Repeated voice-overs (title sequences etc.) are only signed once
+
+	# Union-find over cue positions
+	parent = list(range(len(cues)))
+
+	def find(i:int) -> int:
+		while parent[i] != i:
+			parent[i] = parent[parent[i]]
+			i = parent[i]
+		return i
+
+	buckets:dict = {}
+	known:dict = {}
+
+	for i, cue_shingles in enumerate(shingles):
+		if len(cue_shingles) == 0:
+			continue
+
+		voiceover = cues[i][1].voice_over
+		signature = signatures.get(voiceover)
+		if signature is None:
+			signature = signatures[voiceover] = get_minhash(cue_shingles, known)
+
+		for band in range(MINHASH_BANDS):
+			key = (band,) + signature[band * MINHASH_ROWS:(band + 1) * MINHASH_ROWS]
+			first = buckets.setdefault(key, i)
+
+			if first != i and find(first) != find(i):
+				shared = len(shingles[first] & cue_shingles)
+				similarity = shared / (len(shingles[first]) + len(cue_shingles) - shared)
+				if similarity >= threshold:
+					parent[find(i)] = find(first)
+
+	clusters:dict = {}
+	for i in range(len(cues)):
+		clusters.setdefault(find(i), []).append(cues[i])
+
+	return sorted((cluster for cluster in clusters.values() if len(cluster) > 1), key=len, reverse=True)
+
+
+
+# =======================================
+
+#	Shared memory (for process pools)
+
+# =======================================
+
+class AdSharedScript:
+
+	"""
+	A parsed script packed into one block of shared memory, so process pool
+	workers can read it without it being pickled to each of them. Pickling
+	one of these only sends the name of the block.
+
+	Layout: the number of cues, then int64 columns of cue numbers, start and
+	end times (ms) and text offsets, then all the voice-overs as UTF-8.
+
+		shared = AdSharedScript.create(ad_script)
+		try:
+			results = map_cues(count_words, shared)
+		finally:
+			shared.close()
+			shared.unlink()
+	"""
+
+	def __init__(self, name:str):
+
+		""" Attach to a script someone else created """
+
+		self.memory = shared_memory.SharedMemory(name)
+		self.attach()
+
+	def attach(self):
+
+		buffer = self.memory.buf
+		self.length:int = buffer[0:8].cast("q")[0]
+
+		n = self.length
+		columns = buffer[8:8 + 8 * (4 * n + 1)].cast("q")
+		self.numbers = columns[0:n]
+		self.starts = columns[n:2 * n]
+		self.ends = columns[2 * n:3 * n]
+		self.offsets = columns[3 * n:4 * n + 1]
+		self.text = buffer[8 + 8 * (4 * n + 1):]
+		self.views = [columns]
+
+	@classmethod
+	def create(cls, ad_script:list[AdEvent]) -> "AdSharedScript":
+
+		""" Pack a script into a new block of shared memory. Remember to unlink() it when done. """
+
+		texts = [event.voice_over.encode("utf-8") for event in ad_script]
+
+		offsets = [0]
+		for text in texts:
+			offsets.append(offsets[-1] + len(text))
+
+		n = len(ad_script)
+		header = array("q", [n])
+		header.extend(event.number for event in ad_script)
+		header.extend(time_to_ms(event.time_in) for event in ad_script)
+		header.extend(time_to_ms(event.time_out) for event in ad_script)
+		header.extend(offsets)
+		header_bytes = header.tobytes()
+
+		memory = shared_memory.SharedMemory(create=True, size=max(1, len(header_bytes) + offsets[-1]))
+		memory.buf[0:len(header_bytes)] = header_bytes
+		memory.buf[len(header_bytes):len(header_bytes) + offsets[-1]] = b"".join(texts)
+
+		shared = cls.__new__(cls)
+		shared.memory = memory
+		shared.attach()
+
+		return shared
+
+	@property
+	def name(self) -> str:
+		return self.memory.name
+
+	def __reduce__(self):
+		return (AdSharedScript, (self.memory.name,))
+
+	def __len__(self) -> int:
+		return self.length
+
+	def get_voice_over(self, i:int) -> str:
+		return str(self.text[self.offsets[i]:self.offsets[i + 1]], "utf-8")
+
+	def __getitem__(self, i:int) -> AdEvent:
+
+		""" Rebuild cue i (counting from 0) as an AdEvent """
+
+		if i < 0:
+			i += self.length
+		if not 0 <= i < self.length:
+			raise IndexError("No cue at position " + str(i))
+
+		event = create_event(ms_to_time(self.starts[i]), ms_to_time(self.ends[i]), self.get_voice_over(i))
+		event.number = self.numbers[i]
+
+		return event
+
+	def close(self):
+
+		""" Let go of the memory (every process that attached should do this) """
+
+		for view in (self.numbers, self.starts, self.ends, self.offsets, self.text):
+			view.release()
+		for view in self.views:
+			view.release()
+		self.memory.close()
+
+	def __del__(self):
+		if hasattr(self, "views"):
+			self.close()
+
+	def unlink(self):
+
+		""" Free the memory for good (only the creator should do this) """
+
+		self.memory.unlink()
+
+
+def map_cues(function, shared:AdSharedScript, jobs:int = None, chunks:int = None) -> list:
+
+	"""
+	Run function(shared, start, stop) over slices of a shared script in a
+	process pool, and return the results in order. function must be a
+	top level function, so it can be found by the workers.
+	"""
+
+	if chunks is None:
+		chunks = 4 * (os.cpu_count() or 1)
+
+	step = max(1, -(-len(shared) // chunks))
+	starts = list(range(0, len(shared), step))
+
+	with ProcessPoolExecutor(max_workers=jobs) as executor:
+		futures = [executor.submit(function, shared, start, min(start + step, len(shared))) for start in starts]
+		return [future.result() for future in futures]
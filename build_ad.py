@@ -0,0 +1,43 @@
+#!/usr/bin/python3
+
+from adlib import *
+import argparse
+
+"""
+Build a whole series from a manifest, only rebuilding what's out of date.
+
+build_ad.py series.toml
+
+"""
+
+
+def main():
+
+	# Process command line options:
+
+	# ... create
+	parser = argparse.ArgumentParser(description="Build every episode of a series manifest (TOML), rebuilding only out of date files.")
+
+	# ... add arguments
+	parser.add_argument("manifest", help="The series manifest in TOML format")
+	parser.add_argument("-j", help="Number of parallel jobs (default: one per CPU)", dest='jobs', type=int)
+	parser.add_argument("--force", help="Rebuild everything, even if it's up to date", action='store_true')
+
+	# ... parse
+	args = parser.parse_args()
+
+	series = load_manifest(args.manifest)
+	written = build_series(series, args.jobs, args.force)
+
+	for output_filename in written:
+		print("Wrote " + output_filename)
+
+	if len(written) == 0:
+		print("Everything is up to date")
+
+if __name__ == '__main__':
+	try:
+		main()
+	except AdError as error:
+		print(error)
+		exit(1)
@@ -0,0 +1,74 @@
+#!/usr/bin/python3
+
+from adlib import *
+import argparse
+
+"""
+Load scripts into a SQLite corpus, and search it.
+
+corpus_ad.py corpus.db ingest script_01.srt script_02.srt
+corpus_ad.py corpus.db ingest -s series.toml
+corpus_ad.py corpus.db search TARDIS
+corpus_ad.py corpus.db search -r "TARDIS OR Dalek*"
+corpus_ad.py corpus.db search -d FAST -l 6 -p "*S02*"
+
+"""
+
+
+def main():
+
+	# Process command line options:
+
+	# ... create
+	parser = argparse.ArgumentParser(description="Load audio-description scripts into a SQLite corpus, and search it.")
+	parser.add_argument("database", help="The corpus database (created if it doesn't exist)")
+	commands = parser.add_subparsers(dest='command', required=True)
+
+	# ... ingest
+	ingest = commands.add_parser("ingest", help="Load SRT files into the corpus. Unchanged files are skipped.")
+	ingest.add_argument("file_names", nargs='*', help="SRT files to load")
+	ingest.add_argument("-m", help="A metadata file in TOML format for the SRT files (optional)", dest='metadata_file', type=str)
+	ingest.add_argument("-s", help="Load every episode of a series manifest", dest='manifest', type=str)
+
+	# ... search
+	search = commands.add_parser("search", help="Search the corpus")
+	search.add_argument("text", nargs='?', help="Full text query on the voice-over, eg: TARDIS")
+	search.add_argument("-d", help="Only cues with this direction, eg: FAST", dest='direction', type=str)
+	search.add_argument("-l", help="Only cues longer than this many seconds", dest='longer_than', type=float)
+	search.add_argument("-p", help="Only scripts whose filename matches this pattern, eg: *S02*", dest='pattern', type=str)
+	search.add_argument("-r", help="The text is an FTS5 query, eg: \"TARDIS OR Dalek*\"", dest='raw', action='store_true')
+
+	# ... parse
+	args = parser.parse_args()
+
+	connection = open_corpus(args.database)
+
+	if args.command == 'ingest':
+		metadata = None
+		if args.metadata_file != None:
+			metadata = AdMetaData()
+			metadata.load_metadata(args.metadata_file)
+
+		scripts = [(file_name, metadata) for file_name in args.file_names]
+
+		if args.manifest != None:
+			series = load_manifest(args.manifest)
+			for episode in series.episodes:
+				scripts.append((episode.script, episode.metadata))
+
+		count = ingest_scripts(connection, scripts)
+		print("Loaded " + str(count) + " of " + str(len(scripts)) + " scripts")
+
+	if args.command == 'search':
+		for file_name, event in search_cues(connection, args.text, args.direction, args.longer_than, args.pattern, args.raw):
+			print(file_name + "\t" + str(event.number) + "\t" + event.time_in + " --> " + event.time_out
+				+ "\t" + event.voice_over.replace('\n', ' '))
+
+	connection.close()
+
+if __name__ == '__main__':
+	try:
+		main()
+	except AdError as error:
+		print(error)
+		exit(1)
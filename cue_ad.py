@@ -0,0 +1,55 @@
+#!/usr/bin/python3
+
+from adlib import *
+import argparse
+
+"""
+Show one cue, a range of cues, or the cues in a stretch of time, from a large
+SRT file without parsing the whole thing. Keeps an index next to the SRT file.
+
+cue_ad.py script_01.srt 12
+cue_ad.py script_01.srt 12 20
+cue_ad.py script_01.srt -t 00:05:00,000 00:06:00,000
+
+"""
+
+
+def main():
+
+	# Process command line options:
+
+	# ... create
+	parser = argparse.ArgumentParser(description="Show cues from an SRT file, using a sidecar index (file_name.idx) instead of reading the whole file.")
+
+	# ... add arguments
+	parser.add_argument("file_name", help="The name of the SRT subtitle file")
+	parser.add_argument("cues", nargs='*', type=int, help="A cue number, or the first and last cue numbers")
+	parser.add_argument("-t", nargs=2, help="Show the cues starting between these two times (00:05:00,000 00:06:00,000)", dest='times')
+	parser.add_argument("--rebuild", help="Rebuild the index even if it looks up to date", action='store_true')
+
+	# ... parse
+	args = parser.parse_args()
+
+	index = load_index(args.file_name, args.rebuild)
+
+	if args.times != None:
+		ad_script = index.get_cues_between(args.times[0], args.times[1])
+	elif len(args.cues) > 0:
+		ad_script = index.get_cues(args.cues[0], args.cues[-1])
+	else:
+		print(str(len(index)) + " cues indexed")
+		ad_script = []
+
+	index.close()
+
+	for event in ad_script:
+		print(str(event.number))
+		print(event.time_in + " --> " + event.time_out)
+		print(event.voice_over + "\n")
+
+if __name__ == '__main__':
+	try:
+		main()
+	except AdError as error:
+		print(error)
+		exit(1)
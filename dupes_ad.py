@@ -0,0 +1,73 @@
+#!/usr/bin/python3
+
+from adlib import *
+import argparse
+
+"""
+Find near-identical cues across many scripts.
+
+dupes_ad.py script_01.srt script_02.srt
+dupes_ad.py -s series.toml
+dupes_ad.py -c corpus.db
+
+"""
+
+
+def main():
+
+	# Process command line options:
+
+	# ... create
+	parser = argparse.ArgumentParser(description="Find clusters of near-identical audio-description cues across scripts.")
+
+	# ... add arguments
+	parser.add_argument("file_names", nargs='*', help="SRT files to compare")
+	parser.add_argument("-s", help="Compare every episode of a series manifest", dest='manifest', type=str)
+	parser.add_argument("-c", help="Compare every cue in a corpus database (see corpus_ad.py)", dest='database', type=str)
+	parser.add_argument("-t", help="How alike cues must be, from 0 to 1 (default 0.8)", dest='threshold', type=float, default=0.8)
+
+	# ... parse
+	args = parser.parse_args()
+
+	file_names = list(args.file_names)
+
+	if args.manifest != None:
+		series = load_manifest(args.manifest)
+		file_names += [episode.script for episode in series.episodes]
+
+	cues = []
+
+	for file_name in file_names:
+		try:
+			file1 = open_file(file_name, 'r')
+			lines = file1.readlines()
+			file1.close()
+		except READ_ERRORS:
+			print("Unable to open file " + file_name)
+			exit(1)
+
+		cues += [(file_name, event) for event in parse_srt(lines)]
+
+	if args.database != None:
+		connection = open_corpus(args.database)
+		cues += search_cues(connection)
+		connection.close()
+
+	# Report
+
+	clusters = find_duplicates(cues, args.threshold)
+
+	for cluster in clusters:
+		print(cluster[0][1].voice_over.replace('\n', ' '))
+		for file_name, event in cluster:
+			print("\t" + file_name + "\t" + str(event.number) + "\t" + event.time_in)
+		print()
+
+	print(str(len(clusters)) + " clusters of near-identical cues")
+
+if __name__ == '__main__':
+	try:
+		main()
+	except AdError as error:
+		print(error)
+		exit(1)
@@ -0,0 +1,76 @@
+#!/usr/bin/python3
+
+from adlib import *
+import argparse
+
+"""
+Check an AD script against the dialogue, and suggest where clashing cues could go.
+
+gaps_ad.py script_01.srt dialogue_01.srt
+
+"""
+
+
+def main():
+
+	# Process command line options:
+
+	# ... create
+	parser = argparse.ArgumentParser(description="Find audio-description cues that talk over the dialogue, and the nearest gap they'd fit in.")
+
+	# ... add arguments
+	parser.add_argument("file_name", help="The SRT audio-description script")
+	parser.add_argument("dialogue_file", help="An SRT subtitle file of the dialogue")
+	parser.add_argument("-a", help="Report every cue, not just the ones that clash", dest='report_all', action='store_true')
+
+	# ... parse
+	args = parser.parse_args()
+
+	# Open and read the SRT files
+
+	scripts = []
+
+	for file_name in (args.file_name, args.dialogue_file):
+		try:
+			file1 = open_file(file_name, 'r')
+			lines = file1.readlines()
+			file1.close()
+		except READ_ERRORS:
+			print("Unable to open file " + file_name)
+			exit(1)
+
+		scripts.append(parse_srt(lines))
+
+	# Report
+
+	clashes = 0
+
+	for gap in find_gaps(scripts[0], scripts[1]):
+
+		if len(gap.collisions) > 0:
+			clashes += 1
+		elif not args.report_all:
+			continue
+
+		event = gap.event
+		report = str(event.number) + "\t" + event.time_in + " --> " + event.time_out
+
+		if gap.gap_end == sys.maxsize:
+			report += "\tgap: to the end"
+		else:
+			report += "\tgap: " + str((gap.gap_end - gap.gap_start) / 1000) + "s"
+
+		if len(gap.collisions) > 0:
+			report += "\tclashes with dialogue " + ", ".join(str(line.number) for line in gap.collisions)
+			report += "\tsuggest: " + ms_to_time(gap.suggestion)
+
+		print(report)
+
+	print(str(clashes) + " of " + str(len(scripts[0])) + " cues clash with dialogue")
+
+if __name__ == '__main__':
+	try:
+		main()
+	except AdError as error:
+		print(error)
+		exit(1)
@@ -22,21 +22,26 @@ def main():
 	parser.add_argument("file_name", help="The name of the SRT subtitle file to convert")
 	parser.add_argument("-m", help="A metadata file in TOML format (optional)", dest='metadata_file', type=str) 
 	parser.add_argument("-o", help="Output filename (no extension required)", dest='output_filename', type=str) 
-	parser.add_argument('-f', nargs='+', help="List of formats, separated by space. Possible values are: csv, html, rtf, vtt, kyle, md", dest='formats')
+	parser.add_argument('-f', nargs='+', help="List of formats, separated by space. Possible values are: csv, html, rtf, vtt, words, kyle, md, srt (words is webvtt with a timestamp on every word)", dest='formats')
+	parser.add_argument("-z", help="Compress every output file with the given codec (not with -b)", dest='compression', choices=['gz', 'bz2', 'xz'])
+	parser.add_argument("-b", help="Write every output into a single zip archive (with a manifest), instead of separate files", dest='bundle', action='store_true')
 
 	# ... parse
 	args = parser.parse_args()
 
+	if args.bundle and args.compression != None:
+		parser.error("-z can't be used with -b, the zip archive is compressed already")
 
-	# Open and read the SRT file
+
+	# Open and read the SRT file (.gz, .bz2 and .xz are decompressed as we go)
 
 	try:
-		file1 = open(args.file_name, 'r')
+		file1 = open_file(args.file_name, 'r')
 		lines = file1.readlines()
 		file1.close()
-	except:
+	except READ_ERRORS:
 		print("Unable to open file " + args.file_name)
-		exit()
+		exit(1)
 
 	srt_file = parse_srt(lines)
 
@@ -53,29 +58,27 @@ def main():
 	else:
 		filename = args.output_filename
 
-	# Now convert
-
-	if 'csv' in args.formats:
-		write_csv(filename + ".csv", srt_file)
-	
-	if 'vtt' in args.formats:
-		write_webvtt(filename + ".vtt", srt_file, metadata)
-
-	if 'rtf' in args.formats:
-		write_rtf(filename + ".rtf", srt_file, metadata)
+	# Compressed output just tacks the codec's extension onto every file
 
-	if 'html' in args.formats:
-		write_html(filename + ".html", srt_file, metadata)
+	ext = ""
+	if args.compression != None:
+		ext = "." + args.compression
 
-	if 'srt' in args.formats:
-		write_srt(filename + ".srt", srt_file)
+	# Bundles go straight into filename.zip
 
-	if 'kyle' in args.formats:
-		# Kyle no like numbered cues
-		write_kyle(filename + "-Cues.rtf", srt_file, metadata, False, True)
-
-	if 'md' in args.formats:
-		write_markdown(filename + ".md", srt_file, metadata, False)
+	if args.bundle:
+		with AdBundle(filename + ".zip", metadata) as bundle:
+			for fmt in OUTPUT_FORMATS:
+				if fmt in args.formats:
+					write_format(fmt, filename, srt_file, metadata, bundle=bundle)
+	else:
+		for fmt in OUTPUT_FORMATS:
+			if fmt in args.formats:
+				write_format(fmt, filename, srt_file, metadata, ext)
 
 if __name__ == '__main__':
-	main()
+	try:
+		main()
+	except AdError as error:
+		print(error)
+		exit(1)